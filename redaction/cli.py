@@ -1,16 +1,30 @@
 """
 PII redaction script using Microsoft Presidio.
-Processes a file line by line and creates an output file with redacted content.
+Processes a file in batches of lines and creates an output file with redacted content.
 """
 
 import argparse
+import json
 import sys
+from collections import OrderedDict
+from functools import partial
 from pathlib import Path
 
+from redaction.core import (
+    PII_GATE,
+    needs_analysis,
+    resolve_paths,
+    stream_redact,
+    stream_redact_parallel,
+)
+
 # Import Presidio
 try:
-    from presidio_analyzer import AnalyzerEngine
+    from presidio_analyzer import AnalyzerEngine, BatchAnalyzerEngine, RecognizerRegistry
+    from presidio_analyzer.nlp_engine import NlpEngineProvider
     from presidio_anonymizer import AnonymizerEngine
+    from presidio_anonymizer.entities import InvalidParamError, OperatorConfig
+    from presidio_anonymizer.operators import OperatorsFactory, OperatorType
 except ImportError:
     print("Please install presidio: pip install presidio-analyzer presidio-anonymizer")
     sys.exit(1)
@@ -23,64 +37,333 @@ except ImportError:
     RichHelpFormatter = argparse.RawDescriptionHelpFormatter
 
 
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_CACHE_SIZE = 200_000
+# The small model is roughly 4x faster at NER than Presidio's default en_core_web_lg
+DEFAULT_MODEL = "en_core_web_sm"
+
+
+def enable_gpu():
+    """Run spaCy on the GPU if one is available, falling back to the CPU otherwise."""
+    import spacy
+
+    try:
+        spacy.require_gpu()
+    except Exception as e:
+        print(f"GPU not available, using CPU ({e}).")
+        print("For GPU support: pip install 'redaction[gpu]'\n")
+        return False
+    return True
+
+
+def splice_results(text, results):
+    """Replace each result with <ENTITY_TYPE>, like the anonymizer's default operator.
+
+    Returns None when the anonymizer would have to resolve the spans itself:
+    overlapping results, or same-type results separated only by whitespace,
+    which it merges into one.
+    """
+    parts = []
+    cursor = 0
+    previous = None
+    for result in sorted(results, key=lambda r: r.start):
+        if result.start < cursor:
+            return None
+        if (previous is not None and previous.entity_type == result.entity_type
+                and not text[cursor:result.start].strip()):
+            return None
+        parts.append(text[cursor:result.start])
+        parts.append(f"<{result.entity_type}>")
+        cursor = result.end
+        previous = result
+    parts.append(text[cursor:])
+    return "".join(parts)
+
+
+def build_operators(operators):
+    """Turn {entity: {"type": ..., **params}} settings into Presidio OperatorConfigs."""
+    configs = {}
+    for entity, settings in operators.items():
+        params = dict(settings)
+        configs[entity] = OperatorConfig(params.pop("type"), params)
+    return configs
+
+
+def load_operators(path):
+    """Read custom operator settings from a JSON file, or None if it's unusable."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            operators = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Error: Could not read operators file '{path}': {e}")
+        return None
+
+    if not isinstance(operators, dict) or not all(
+        isinstance(settings, dict) and "type" in settings for settings in operators.values()
+    ):
+        print(f"Error: Operators file '{path}' must map entity types to objects with a \"type\".")
+        return None
+
+    if not check_entities([entity for entity in operators if entity != "DEFAULT"]):
+        return None
+
+    # Catch unknown operators and bad params now, not on the first match mid-file
+    factory = OperatorsFactory()
+    for entity, settings in operators.items():
+        try:
+            config = build_operators({entity: settings})[entity]
+            operator = factory.create_operator_class(config.operator_name, OperatorType.Anonymize)
+            operator.validate(params={**config.params, "entity_type": entity})
+        except (InvalidParamError, TypeError, ValueError) as e:
+            print(f"Error: Invalid operator for '{entity}' in '{path}': {e}")
+            return None
+    return operators
+
+
+def supported_entities():
+    """Return the entity types Presidio's predefined English recognizers can detect."""
+    registry = RecognizerRegistry(supported_languages=["en"])
+    registry.load_predefined_recognizers(languages=["en"])
+    return sorted(registry.get_supported_entities(languages=["en"]))
+
+
+def check_entities(entities):
+    """Print an error and return False if any of entities is not a supported type."""
+    valid = supported_entities()
+    unknown = [e for e in entities if e not in valid]
+    if unknown:
+        print(f"Error: Unknown entity type(s): {', '.join(unknown)}")
+        print(f"Valid types: {', '.join(valid)}")
+        return False
+    return True
+
+
+def build_registry(nlp_engine, entities=None):
+    """Load the predefined recognizers, keeping only those that detect the wanted entities."""
+    registry = RecognizerRegistry(supported_languages=["en"])
+    registry.load_predefined_recognizers(nlp_engine=nlp_engine, languages=["en"])
+    if entities:
+        wanted = set(entities)
+        registry.recognizers = [
+            r for r in registry.recognizers if wanted & set(r.supported_entities)
+        ]
+    return registry
+
+
 class PresidioRedactor:
     """Handles PII redaction using Microsoft Presidio."""
 
-    def __init__(self):
-        """Initialize Presidio engines."""
-        self.presidio_analyzer = AnalyzerEngine()
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, gpu=False, cache_size=DEFAULT_CACHE_SIZE,
+                 fast_gate=True, entities=None, model=DEFAULT_MODEL, operators=None):
+        """Initialize Presidio engines.
+
+        operators maps entity types (or "DEFAULT") to operator settings such as
+        {"type": "mask", "masking_char": "*", "chars_to_mask": 4}. Without it,
+        spans are replaced with <ENTITY_TYPE>.
+        """
+        self.batch_size = batch_size
+        self._pii_gate = PII_GATE if fast_gate else None
+        self.entities = list(entities) if entities else None
+        # spaCy has to be switched to the GPU before the NLP engine loads its model
+        if gpu:
+            enable_gpu()
+        nlp_engine = NlpEngineProvider(nlp_configuration={
+            "nlp_engine_name": "spacy",
+            "models": [{"lang_code": "en", "model_name": model}],
+        }).create_engine()
+        self.presidio_analyzer = AnalyzerEngine(
+            nlp_engine=nlp_engine,
+            registry=build_registry(nlp_engine, self.entities),
+            supported_languages=["en"],
+        )
         self.presidio_anonymizer = AnonymizerEngine()
+        self.operators = build_operators(operators) if operators else None
+        self.batch_analyzer = BatchAnalyzerEngine(analyzer_engine=self.presidio_analyzer)
+
+        # The default replacement gives the same output for the same line, so repeated
+        # lines can reuse it. Custom operators may not (encrypt uses a random IV).
+        self.reuse_results = cache_size > 0 and self.operators is None
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_lookups = 0
+
+    @property
+    def scan(self):
+        """Whether stream_redact may pre-filter lines with the byte scanner."""
+        return self._pii_gate is not None
+
+    def _cache_get(self, text):
+        """Return the cached redaction of text, or None on a miss."""
+        self.cache_lookups += 1
+        redacted = self._cache.get(text)
+        if redacted is not None:
+            self._cache.move_to_end(text)
+            self.cache_hits += 1
+        return redacted
+
+    def _cache_put(self, text, redacted):
+        """Store a redacted line, evicting the least recently used entry when full."""
+        if self.cache_size <= 0:
+            return
+        self._cache[text] = redacted
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _should_analyze(self, text):
+        """Decide whether a line is worth sending through the analyzer."""
+        if self._pii_gate is not None:
+            return self._pii_gate.search(text) is not None
+        return needs_analysis(text)
+
+    @property
+    def cache_hit_rate(self):
+        """Fraction of cache lookups that were hits."""
+        return self.cache_hits / self.cache_lookups if self.cache_lookups else 0.0
+
+    def _cache_status(self):
+        """Progress suffix reporting the cache hit rate."""
+        return f"cache hit rate {self.cache_hit_rate:.1%}"
+
+    def _anonymize(self, text, results):
+        """Replace detected spans, skipping the AnonymizerEngine when a plain splice will do."""
+        # Custom operators always need the full anonymizer
+        redacted = splice_results(text, results) if self.operators is None else None
+        if redacted is None:
+            redacted = self.presidio_anonymizer.anonymize(
+                text=text, analyzer_results=results, operators=self.operators
+            ).text
+        return redacted
 
     def redact(self, text):
         """Redact PII using Microsoft Presidio."""
+        if not self._should_analyze(text):
+            return text
+
+        if self.reuse_results:
+            cached = self._cache_get(text)
+            if cached is not None:
+                return cached
+
         # Analyze the text for PII
-        results = self.presidio_analyzer.analyze(text=text, language="en")
+        results = self.presidio_analyzer.analyze(
+            text=text, language="en", entities=self.entities
+        )
 
         # Anonymize the detected PII if any found
-        if results:
-            anonymized = self.presidio_anonymizer.anonymize(
-                text=text, analyzer_results=results
+        redacted = self._anonymize(text, results) if results else text
+
+        if self.reuse_results:
+            self._cache_put(text, redacted)
+        return redacted
+
+    def redact_batch(self, lines, gated=False):
+        """Redact a batch of lines, running spaCy over the whole batch at once.
+
+        gated=True means the byte scanner already matched PII_GATE on every line.
+        """
+        redacted = [None] * len(lines)
+
+        # Bind per-line lookups once, outside the loop
+        if gated:
+            should_analyze = None
+        else:
+            should_analyze = (
+                self._pii_gate.search if self._pii_gate is not None else needs_analysis
             )
-            return anonymized.text
-        return text
+        cache_get = self._cache_get
+        reuse = self.reuse_results
+
+        # Only unique, uncached lines go through the analyzer; without reuse,
+        # every line is analyzed and anonymized on its own
+        misses = {}
+        for i, line in enumerate(lines):
+            if should_analyze is not None and not should_analyze(line):
+                redacted[i] = line
+            elif not reuse:
+                misses[i] = [i]
+            elif (cached := cache_get(line)) is not None:
+                redacted[i] = cached
+            elif line in misses:
+                self.cache_hits += 1
+                misses[line].append(i)
+            else:
+                misses[line] = [i]
+
+        if not misses:
+            return redacted
+
+        pending = list(misses.values())
+        texts = [lines[indexes[0]] for indexes in pending]
+        results_iter = self.batch_analyzer.analyze_iterator(
+            texts, language="en", batch_size=self.batch_size, entities=self.entities
+        )
+
+        anonymize = self._anonymize
+        cache_put = self._cache_put
+        for indexes, text, results in zip(pending, texts, results_iter):
+            line = anonymize(text, results) if results else text
+            if reuse:
+                cache_put(text, line)
+            for i in indexes:
+                redacted[i] = line
+        return redacted
 
     def process_file(self, input_file, output_file=None):
-        """Process a file line by line using Presidio."""
-        input_path = Path(input_file)
-        if not input_path.exists():
-            print(f"Error: Input file '{input_file}' not found.")
+        """Process a file block by block using Presidio."""
+        paths = resolve_paths(input_file, output_file)
+        if paths is None:
             return False
+        input_path, output_path = paths
+
+        line_count = stream_redact(
+            input_path,
+            output_path,
+            self,
+            status=self._cache_status if self.reuse_results else None,
+        )
+
+        print(f"\nSuccessfully processed {line_count} non-empty lines.")
+        return True
+
 
-        # Determine output file name
-        output_path = Path(output_file or f"{input_path.stem}_redacted.txt")
+def ensure_model(model):
+    """Download the spaCy model if it isn't installed yet.
 
-        print(f"Processing file: {input_path}")
-        print(f"Output file: {output_path}\n")
+    Presidio does this on its own when the engine loads, but with several
+    worker processes each of them would start the same download at once.
+    """
+    import spacy
 
-        # Process the file
-        with open(input_path, "r", encoding="utf-8") as infile, \
-             open(output_path, "w", encoding="utf-8") as outfile:
+    if spacy.util.is_package(model) or Path(model).exists():
+        return
+    print(f"Downloading spaCy model '{model}'...\n")
+    spacy.cli.download(model)
 
-            line_count = 0
-            for line_num, line in enumerate(infile, 1):
-                line_content = line.rstrip("\n")
 
-                # Handle empty lines
-                if not line_content:
-                    outfile.write("\n")
-                    continue
+def process_file_parallel(input_file, output_file=None, workers=2, model=DEFAULT_MODEL,
+                          **redactor_kwargs):
+    """Process a file across several worker processes and merge the results in order.
 
-                line_count += 1
+    Extra keyword arguments are passed to each worker's PresidioRedactor.
+    """
+    paths = resolve_paths(input_file, output_file)
+    if paths is None:
+        return False
+    input_path, output_path = paths
 
-                # Apply Presidio redaction and write output
-                outfile.write(self.redact(line_content) + "\n")
+    # Fetch the model once here rather than once per worker
+    ensure_model(model)
 
-                # Progress indicator for large files
-                if line_num % 100 == 0:
-                    print(f"  Processed {line_num} lines...")
+    line_count = stream_redact_parallel(
+        input_path,
+        output_path,
+        partial(PresidioRedactor, model=model, **redactor_kwargs),
+        workers=workers,
+    )
 
-            print(f"\nSuccessfully processed {line_count} non-empty lines.")
-            return True
+    print(f"\nSuccessfully processed {line_count} non-empty lines.")
+    return True
 
 
 def main():
@@ -112,14 +395,85 @@ including names, email addresses, phone numbers, SSNs, credit card numbers, and
         metavar="OUTPUT",
         help="Output file name (default: <input>_redacted.txt)",
     )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        metavar="N",
+        help=f"Number of non-empty lines analyzed per batch (default: {DEFAULT_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--gpu",
+        action="store_true",
+        help="Run spaCy NER on the GPU (requires CuPy: pip install 'redaction[gpu]')",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        metavar="W",
+        help="Number of worker processes, each with its own Presidio engines (default: 1)",
+    )
+    parser.add_argument(
+        "--no-fast-gate",
+        dest="fast_gate",
+        action="store_false",
+        help="Analyze every line, including ones without digits, '@' or capitalized words",
+    )
+    parser.add_argument(
+        "-e",
+        "--entities",
+        type=lambda value: [e.strip().upper() for e in value.split(",") if e.strip()],
+        metavar="TYPES",
+        help="Comma-separated entity types to redact, e.g. PERSON,EMAIL_ADDRESS (default: all)",
+    )
+    parser.add_argument(
+        "--model",
+        default=DEFAULT_MODEL,
+        help=f"spaCy model used for NER (default: {DEFAULT_MODEL})",
+    )
+    parser.add_argument(
+        "--custom-operators",
+        metavar="JSON",
+        help="JSON file of Presidio anonymizer operators per entity type "
+             "(default: replace each span with <ENTITY_TYPE>)",
+    )
 
     args = parser.parse_args()
 
+    # A misspelled type would otherwise drop its recognizer and leave that PII in place
+    if args.entities and not check_entities(args.entities):
+        sys.exit(1)
+
+    operators = None
+    if args.custom_operators:
+        operators = load_operators(args.custom_operators)
+        if operators is None:
+            sys.exit(1)
+
+    redactor_kwargs = {
+        "batch_size": args.batch_size,
+        "gpu": args.gpu,
+        "fast_gate": args.fast_gate,
+        "entities": args.entities,
+        "model": args.model,
+        "operators": operators,
+    }
+
     # Initialize the redactor and process the file
-    print("Initializing Presidio...\n")
-    redactor = PresidioRedactor()
+    if args.workers > 1:
+        print(f"Initializing Presidio in {args.workers} worker processes...\n")
+        ok = process_file_parallel(
+            args.input_file, args.output_file, workers=args.workers, **redactor_kwargs
+        )
+    else:
+        print("Initializing Presidio...\n")
+        redactor = PresidioRedactor(**redactor_kwargs)
+        ok = redactor.process_file(args.input_file, args.output_file)
 
-    if redactor.process_file(args.input_file, args.output_file):
+    if ok:
         print("\nRedaction complete!")
         print("Note: Always manually review the output file to ensure all sensitive data has been properly redacted.")
     else:
@@ -0,0 +1,372 @@
+"""
+Streaming helpers shared by redaction backends.
+Reads the input in blocks, hands the lines to a backend's batch function and
+writes the results back in their original order.
+"""
+
+import queue
+import re
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Numba is optional; without it the regex gate does all the filtering
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    np = njit = None
+
+
+BLOCK_SIZE = 1 << 20
+PROGRESS_INTERVAL = 1.0  # seconds
+PREFETCH_DEPTH = 2  # blocks queued ahead of/behind the analyzer
+
+
+# Cheap pre-scan: digits, '@' or a capitalized word. Lines without any of these
+# skip NER entirely, at the cost of missing e.g. lowercase names or bare URLs.
+PII_GATE = re.compile(r"[\d@]|\b[A-Z][a-z]")
+
+
+def _scan_lines(buf, flags):
+    """Byte-level PII_GATE: set flags[i] if line i of buf might hold PII.
+
+    Lines are split on newline bytes only. A flag of 1 means PII_GATE matches
+    the line. A non-ASCII byte before any match sets 2 instead, leaving Unicode
+    digits and word boundaries to the regex. Returns the number of lines
+    scanned.
+    """
+    n_lines = 0
+    flag = 0
+    prev_word = False
+    size = len(buf)
+    for i in range(size):
+        c = buf[i]
+        if c == 10:
+            flags[n_lines] = flag
+            n_lines += 1
+            flag = 0
+            prev_word = False
+            continue
+        if flag:
+            continue
+        if c >= 128:
+            flag = 2
+        elif c == 64 or 48 <= c <= 57:
+            flag = 1
+        elif 65 <= c <= 90 and not prev_word and i + 1 < size and 97 <= buf[i + 1] <= 122:
+            flag = 1
+        prev_word = 65 <= c <= 90 or 97 <= c <= 122 or c == 95
+    if size and buf[size - 1] != 10:
+        flags[n_lines] = flag
+        n_lines += 1
+    return n_lines
+
+
+scan_lines = njit(cache=True)(_scan_lines) if njit is not None else None
+
+
+# Replacement tokens written by the default anonymizer operator, e.g. <PERSON>
+PLACEHOLDER = re.compile(r"<[A-Z_]+>")
+
+
+def needs_analysis(text):
+    """Return False for lines with nothing PII could be made of.
+
+    That covers separators and lines that are already fully redacted, e.g. when
+    re-running over previous output.
+    """
+    if "<" in text:
+        text = PLACEHOLDER.sub("", text)
+    return any(c.isalnum() for c in text)
+
+
+def resolve_paths(input_file, output_file=None):
+    """Check the input file and work out the output path, printing both."""
+    input_path = Path(input_file)
+    if not input_path.exists():
+        print(f"Error: Input file '{input_file}' not found.")
+        return None
+
+    # Determine output file name
+    output_path = Path(output_file or f"{input_path.stem}_redacted.txt")
+
+    print(f"Processing file: {input_path}")
+    print(f"Output file: {output_path}\n")
+    return input_path, output_path
+
+
+def shard_offsets(input_path, shards):
+    """Split a file into byte ranges that start and end on line boundaries."""
+    size = input_path.stat().st_size
+    offsets = [0]
+    with open(input_path, "rb") as f:
+        for i in range(1, shards):
+            f.seek(max(size * i // shards, offsets[-1]))
+            # Snap forward to the start of the next line
+            f.readline()
+            offsets.append(min(f.tell(), size))
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if start < end]
+
+
+def _split_lines(data):
+    """Decode a chunk of complete lines, treating CRLF and CR endings like text mode does."""
+    text = data.decode("utf-8")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text.split("\n")
+
+
+def _make_block(data, scan):
+    """Split decoded lines out of data, plus scanner flags when scanning is possible."""
+    lines = _split_lines(data)
+    if lines[-1] == "":
+        lines.pop()
+
+    flags = None
+    # The scanner only knows about \n, so CR line endings fall back to the regex
+    if scan and scan_lines is not None and b"\r" not in data:
+        flags = np.empty(len(lines), dtype=np.uint8)
+        scan_lines(np.frombuffer(data, dtype=np.uint8), flags)
+    return lines, flags
+
+
+def read_blocks(infile, start=0, end=None, block_size=BLOCK_SIZE, scan=False):
+    """Yield (lines, flags) blocks from a binary file, reading block_size bytes at a time.
+
+    Only the byte range [start, end) is read; it must begin on a line boundary.
+    With scan=True and Numba installed, flags marks the lines that might hold
+    PII; otherwise it is None.
+    """
+    infile.seek(start)
+    remaining = float("inf") if end is None else end - start
+    carry = b""
+    while remaining > 0:
+        block = infile.read(int(min(block_size, remaining)))
+        if not block:
+            break
+        remaining -= len(block)
+
+        # Hold back the trailing partial line until the next block arrives
+        data = carry + block
+        cut = data.rfind(b"\n") + 1
+        carry = data[cut:]
+        if cut:
+            yield _make_block(data[:cut], scan)
+
+    # Last line without a trailing newline
+    if carry:
+        yield _make_block(carry, scan)
+
+
+class _EndOfStream:
+    """Queue marker for the end of a background stream, carrying any error raised."""
+
+    def __init__(self, error=None):
+        self.error = error
+
+
+def prefetch(iterable, depth=PREFETCH_DEPTH):
+    """Iterate over iterable from a background thread, keeping up to depth items ready."""
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def produce():
+        error = None
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                items.put(item)
+        except Exception as e:
+            error = e
+        if not stop.is_set():
+            items.put(_EndOfStream(error))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while not isinstance(item := items.get(), _EndOfStream):
+            yield item
+        if item.error is not None:
+            raise item.error
+    finally:
+        # If the consumer stopped early, unblock the producer so its thread can exit
+        stop.set()
+        while True:
+            try:
+                items.get_nowait()
+            except queue.Empty:
+                break
+
+
+class BackgroundWriter:
+    """Writes lists of lines to a file from a background thread."""
+
+    def __init__(self, outfile, depth=PREFETCH_DEPTH):
+        self._queue = queue.Queue(maxsize=depth)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, args=(outfile,), daemon=True)
+        self._thread.start()
+
+    def _run(self, outfile):
+        while (lines := self._queue.get()) is not None:
+            # Keep draining after a failure so writelines() never blocks
+            if self._error is None:
+                try:
+                    outfile.writelines(lines)
+                except Exception as e:
+                    self._error = e
+
+    def writelines(self, lines):
+        """Queue lines to be written."""
+        if self._error is not None:
+            raise self._error
+        self._queue.put(lines)
+
+    def _finish(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def close(self):
+        """Wait for all queued lines to be written."""
+        self._finish()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Don't let a follow-on write error mask the exception already in flight
+        if exc_type is None:
+            self.close()
+        else:
+            self._finish()
+
+
+def redact_blocks(blocks, outfile, redact_batch_fn, progress=True, status=None):
+    """Redact blocks of lines and write each block to outfile in one call.
+
+    Blocks are (lines, flags) pairs as produced by read_blocks, and
+    redact_batch_fn maps a list of lines to their redacted versions. When the
+    scanner has already matched PII_GATE on every line it passes, it is called
+    with gated=True so the regex need not run again. Reading
+    the next block and writing the previous one happen in background threads
+    while the current block is being redacted. status, if given, returns extra
+    text for the progress line. Returns the number of non-empty lines.
+    """
+    line_count = 0
+    line_num = 0
+    start = last_print = time.monotonic()
+    with BackgroundWriter(outfile) as writer:
+        writelines = writer.writelines
+        for lines, flags in prefetch(blocks):
+            # Blank lines and lines the scanner cleared skip analysis
+            if flags is None:
+                todo = [bool(line) for line in lines]
+                gated = False
+            else:
+                todo = [bool(flag) and bool(line) for line, flag in zip(lines, flags)]
+                # Without non-ASCII lines every flag is an exact PII_GATE match
+                gated = not (flags == 2).any()
+            batch = [line for line, t in zip(lines, todo) if t]
+            redacted = iter(redact_batch_fn(batch, gated=True) if gated else redact_batch_fn(batch))
+            writelines(
+                [(next(redacted) if t else line) + "\n" for line, t in zip(lines, todo)]
+            )
+            line_count += sum(1 for line in lines if line)
+            line_num += len(lines)
+
+            # Progress indicator for large files, at most once per interval
+            now = time.monotonic()
+            if progress and now - last_print >= PROGRESS_INTERVAL:
+                extra = f", {status()}" if status is not None else ""
+                print(f"  Processed {line_num} lines ({line_num / (now - start):.0f} lines/s{extra})...")
+                sys.stdout.flush()
+                last_print = now
+
+    return line_count
+
+
+def stream_redact(input_path, output_path, redactor, start=0, end=None,
+                  progress=True, status=None):
+    """Redact input_path (or its byte range [start, end)) into output_path.
+
+    redactor provides redact_batch(lines) and may set a true scan attribute,
+    in which case lines the byte scanner rules out never reach it and
+    redact_batch must also accept gated (see redact_blocks). Returns the
+    number of non-empty lines.
+    """
+    scan = getattr(redactor, "scan", False)
+    with open(input_path, "rb") as infile, \
+         open(output_path, "w", encoding="utf-8", buffering=BLOCK_SIZE) as outfile:
+        blocks = read_blocks(infile, start, end, scan=scan)
+        return redact_blocks(
+            blocks, outfile, redactor.redact_batch, progress=progress, status=status
+        )
+
+
+# Each worker process builds its own redactor once; spaCy pipelines don't pickle well
+_worker_redactor = None
+
+
+def _init_worker(make_redactor):
+    """Initialize the per-process redactor."""
+    global _worker_redactor
+    _worker_redactor = make_redactor()
+
+
+def _process_shard(input_path, start, end, part_path):
+    """Redact one byte range of the input into its own part file."""
+    return stream_redact(
+        input_path, part_path, _worker_redactor, start=start, end=end, progress=False
+    )
+
+
+def stream_redact_parallel(input_path, output_path, make_redactor, workers=2):
+    """Redact a file across several worker processes and merge the results in order.
+
+    make_redactor is a picklable callable, e.g. a functools.partial of a redactor
+    class, that builds a redactor (see stream_redact) in each worker.
+    Returns the number of non-empty lines.
+    """
+    shards = shard_offsets(input_path, workers)
+    part_paths = [
+        output_path.with_name(f"{output_path.name}.part{i}") for i in range(len(shards))
+    ]
+
+    try:
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(make_redactor,),
+        )
+        try:
+            futures = [
+                executor.submit(_process_shard, input_path, start, end, part_path)
+                for (start, end), part_path in zip(shards, part_paths)
+            ]
+            line_count = 0
+            for i, future in enumerate(futures, 1):
+                line_count += future.result()
+                print(f"  Finished shard {i}/{len(futures)}...")
+        except BaseException:
+            # Surface the first failure without waiting on the other shards
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+
+        # Stitch the parts back together in their original order
+        with open(output_path, "wb") as outfile:
+            for part_path in part_paths:
+                with open(part_path, "rb") as part:
+                    shutil.copyfileobj(part, outfile)
+    finally:
+        for part_path in part_paths:
+            part_path.unlink(missing_ok=True)
+
+    return line_count
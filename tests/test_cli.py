@@ -0,0 +1,152 @@
+import copy
+import json
+import random
+import re
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("presidio_analyzer")
+pytest.importorskip("presidio_anonymizer")
+
+from presidio_analyzer import RecognizerResult
+from presidio_anonymizer import AnonymizerEngine
+
+from redaction import cli
+from redaction.cli import splice_results
+
+ENTITY_TYPES = ["PERSON", "EMAIL_ADDRESS", "PHONE_NUMBER"]
+README = Path(__file__).resolve().parent.parent / "README.md"
+
+
+def random_case(rng):
+    text = "".join(rng.choice("ab  .,\t") for _ in range(rng.randint(1, 30)))
+    results = []
+    for _ in range(rng.randint(1, 4)):
+        start = rng.randrange(len(text))
+        end = rng.randint(start + 1, len(text))
+        results.append(RecognizerResult(
+            rng.choice(ENTITY_TYPES), start, end, rng.choice([0.3, 0.6, 0.85, 1.0])
+        ))
+    return text, results
+
+
+def anonymize(text, results):
+    # The anonymizer edits results in place while resolving conflicts
+    return AnonymizerEngine().anonymize(text=text, analyzer_results=copy.deepcopy(results)).text
+
+
+def test_splice_replaces_with_entity_type():
+    text = "Call John at 555-1234 or john@example.com"
+    results = [
+        RecognizerResult("PERSON", 5, 9, 0.85),
+        RecognizerResult("EMAIL_ADDRESS", 25, 41, 1.0),
+        RecognizerResult("PHONE_NUMBER", 13, 21, 0.75),
+    ]
+    assert splice_results(text, results) == "Call <PERSON> at <PHONE_NUMBER> or <EMAIL_ADDRESS>"
+    assert splice_results(text, results) == anonymize(text, results)
+
+
+def test_splice_defers_conflicts_to_anonymizer():
+    # Overlapping spans and same-type neighbours split by whitespace
+    assert splice_results("abcdef", [
+        RecognizerResult("PERSON", 0, 4, 0.8),
+        RecognizerResult("PHONE_NUMBER", 2, 6, 0.9),
+    ]) is None
+    assert splice_results("John Smith", [
+        RecognizerResult("PERSON", 0, 4, 0.8),
+        RecognizerResult("PERSON", 5, 10, 0.8),
+    ]) is None
+
+
+def test_splice_matches_anonymizer():
+    rng = random.Random(0)
+    spliced = 0
+    for _ in range(2000):
+        text, results = random_case(rng)
+        redacted = splice_results(text, results)
+        if redacted is not None:
+            spliced += 1
+            assert redacted == anonymize(text, results), (text, results)
+    # Make sure the fast path was actually exercised
+    assert spliced > 100
+
+
+class CountingAnalyzer:
+    """Stands in for BatchAnalyzerEngine, recording every text it is given."""
+
+    def __init__(self):
+        self.texts = []
+
+    def analyze_iterator(self, texts, **kwargs):
+        for text in texts:
+            self.texts.append(text)
+            start = text.find("Alice")
+            yield [RecognizerResult("PERSON", start, start + 5, 0.85)] if start >= 0 else []
+
+
+@pytest.fixture
+def make_redactor(monkeypatch):
+    # Skip loading spaCy; only the batch analyzer is exercised
+    engine = SimpleNamespace(create_engine=lambda: None)
+    monkeypatch.setattr(cli, "NlpEngineProvider", lambda **kwargs: engine)
+    monkeypatch.setattr(cli, "build_registry", lambda *args, **kwargs: None)
+    monkeypatch.setattr(cli, "AnalyzerEngine", lambda **kwargs: None)
+    monkeypatch.setattr(cli, "BatchAnalyzerEngine", lambda **kwargs: CountingAnalyzer())
+    return cli.PresidioRedactor
+
+
+def test_redact_batch_analyzes_duplicates_once(make_redactor):
+    redactor = make_redactor()
+    lines = ["Hi Alice", "", "Hi Alice", "Bob 42", "Hi Alice"]
+    assert redactor.redact_batch(lines) == ["Hi <PERSON>", "", "Hi <PERSON>", "Bob 42", "Hi <PERSON>"]
+    assert redactor.batch_analyzer.texts == ["Hi Alice", "Bob 42"]
+
+    # Later batches are served from the cache
+    assert redactor.redact_batch(["Bob 42", "Hi Alice"]) == ["Bob 42", "Hi <PERSON>"]
+    assert redactor.batch_analyzer.texts == ["Hi Alice", "Bob 42"]
+    assert redactor.cache_hits == 4
+
+
+def test_redact_batch_evicts_least_recently_used(make_redactor):
+    redactor = make_redactor(cache_size=2)
+    redactor.redact_batch(["Line 1", "Line 2"])
+    redactor.redact_batch(["Line 1"])
+    redactor.redact_batch(["Line 3"])
+    assert list(redactor._cache) == ["Line 1", "Line 3"]
+
+    redactor.redact_batch(["Line 2", "Line 1"])
+    assert redactor.batch_analyzer.texts == ["Line 1", "Line 2", "Line 3", "Line 2"]
+
+
+def test_redact_batch_with_operators_analyzes_every_line(make_redactor):
+    # Operators like encrypt are not deterministic, so nothing is reused
+    redactor = make_redactor(operators={"PERSON": {"type": "replace", "new_value": "X"}})
+    assert redactor.redact_batch(["Hi Alice", "Hi Alice"]) == ["Hi X", "Hi X"]
+    assert redactor.redact_batch(["Hi Alice"]) == ["Hi X"]
+    assert redactor.batch_analyzer.texts == ["Hi Alice"] * 3
+    assert not redactor._cache
+
+
+def write_operators(tmp_path, operators):
+    path = tmp_path / "ops.json"
+    path.write_text(json.dumps(operators), encoding="utf-8")
+    return path
+
+
+def test_readme_operators_example_loads(tmp_path):
+    example = re.search(r"--custom-operators ops\.json`.*?`(\{.*?\})`", README.read_text(encoding="utf-8"))
+    operators = json.loads(example.group(1))
+    assert cli.load_operators(write_operators(tmp_path, operators)) == operators
+
+
+@pytest.mark.parametrize("operators, error", [
+    ({"EMAIL": {"type": "redact"}}, "Error: Unknown entity type(s): EMAIL"),
+    ({"PERSON": {"type": "scramble"}}, "Error: Invalid operator for 'PERSON'"),
+    ({"PERSON": {"type": "mask", "masking_char": "*", "chars_to_mask": 4}}, "Error: Invalid operator for 'PERSON'"),
+    (["PERSON"], "must map entity types"),
+])
+def test_load_operators_rejects_bad_entries(tmp_path, capsys, operators, error):
+    assert cli.load_operators(write_operators(tmp_path, operators)) is None
+    assert error in capsys.readouterr().out
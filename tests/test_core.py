@@ -0,0 +1,187 @@
+import io
+import random
+import threading
+import time
+
+import pytest
+
+from redaction.core import (
+    PII_GATE,
+    BackgroundWriter,
+    _scan_lines,
+    prefetch,
+    read_blocks,
+    scan_lines,
+    stream_redact,
+    stream_redact_parallel,
+)
+
+ASCII_PIECES = ["a", "B", "Bo", "x", "@", "7", " ", "_", "Z", "zA", "Ab", "-", "."]
+NON_ASCII_PIECES = ["é", "Élise", "٣", "€", "日本"]
+
+
+def random_lines(rng, pieces, count=3000):
+    return [
+        "".join(rng.choice(pieces) for _ in range(rng.randint(0, 12)))
+        for _ in range(count)
+    ]
+
+
+def scan(lines, scanner):
+    buf = "\n".join(lines).encode("utf-8") + b"\n"
+    flags = [0] * len(lines)
+    assert scanner(buf, flags) == len(lines)
+    return flags
+
+
+def test_scan_matches_gate_on_ascii():
+    lines = random_lines(random.Random(0), ASCII_PIECES)
+    for line, flag in zip(lines, scan(lines, _scan_lines)):
+        assert bool(flag) == bool(PII_GATE.search(line)), line
+
+
+def test_scan_flags_every_gate_match_on_non_ascii():
+    lines = random_lines(random.Random(1), ASCII_PIECES + NON_ASCII_PIECES)
+    for line, flag in zip(lines, scan(lines, _scan_lines)):
+        if PII_GATE.search(line):
+            assert flag, line
+        if line.isascii():
+            assert bool(flag) == bool(PII_GATE.search(line)), line
+
+
+def test_scan_marks_exact_matches():
+    lines = random_lines(random.Random(3), ASCII_PIECES + NON_ASCII_PIECES)
+    for line, flag in zip(lines, scan(lines, _scan_lines)):
+        if flag == 1:
+            assert PII_GATE.search(line), line
+        elif flag == 2:
+            assert not line.isascii(), line
+
+
+def test_scan_counts_unterminated_last_line():
+    flags = [0, 0]
+    assert _scan_lines(b"plain\nCall 555", flags) == 2
+    assert flags == [0, 1]
+
+
+@pytest.mark.skipif(scan_lines is None, reason="numba not installed")
+def test_jit_scan_matches_python_scan():
+    np = pytest.importorskip("numpy")
+    lines = random_lines(random.Random(2), ASCII_PIECES + NON_ASCII_PIECES)
+    buf = np.frombuffer(("\n".join(lines) + "\n").encode("utf-8"), dtype=np.uint8)
+    flags = np.empty(len(lines), dtype=np.uint8)
+    assert scan_lines(buf, flags) == len(lines)
+    assert flags.tolist() == scan(lines, _scan_lines)
+
+
+class UpperRedactor:
+    def redact_batch(self, lines):
+        return [line.upper() for line in lines]
+
+
+class GateRecorder:
+    scan = True
+
+    def __init__(self):
+        self.calls = []
+
+    def redact_batch(self, lines, gated=False):
+        self.calls.append((lines, gated))
+        return lines
+
+
+class FailingRedactor:
+    def redact_batch(self, lines):
+        raise RuntimeError("backend failed")
+
+
+def text_mode_lines(content):
+    with io.TextIOWrapper(io.BytesIO(content), encoding="utf-8") as infile:
+        return [line.rstrip("\n") for line in infile]
+
+
+@pytest.mark.parametrize("content", [
+    b"",
+    b"\n\n",
+    b"alpha\nbeta\ngamma\n",
+    b"no trailing newline",
+    b"first\r\nsecond\r\n\r\nlast",
+    b"lone\rcarriage\r\rreturns\r",
+    b"mixed\r\nends\rhere\nnow",
+    "para\u2028graph\x85next \xe9t\xe9\nline\u2029two\x0cthree\n".encode("utf-8"),
+    "".join(f"line {i} caf\xe9\r\n" for i in range(40)).encode("utf-8") + b"tail",
+])
+@pytest.mark.parametrize("block_size", [1, 2, 3, 7, 64, 1 << 20])
+def test_read_blocks_matches_text_mode(content, block_size):
+    blocks = read_blocks(io.BytesIO(content), block_size=block_size)
+    assert [line for lines, _ in blocks for line in lines] == text_mode_lines(content)
+
+
+@pytest.mark.parametrize("content, workers", [
+    (b"".join(b"line %d alice\n" % i for i in range(200)) + b"\nlast", 3),
+    (b"one\ntwo\n", 8),
+    (b"", 4),
+    (b"a\rb\r\rc\r", 3),
+    ("mixed\r\nbreaks \x85   \xe9\n".encode("utf-8") * 50, 5),
+])
+def test_parallel_output_matches_serial(tmp_path, content, workers):
+    input_path = tmp_path / "input.txt"
+    input_path.write_bytes(content)
+    serial_path = tmp_path / "serial.txt"
+    parallel_path = tmp_path / "parallel.txt"
+
+    serial_count = stream_redact(input_path, serial_path, UpperRedactor(), progress=False)
+    parallel_count = stream_redact_parallel(
+        input_path, parallel_path, UpperRedactor, workers=workers
+    )
+
+    assert parallel_path.read_bytes() == serial_path.read_bytes()
+    assert parallel_count == serial_count
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "input.txt", "parallel.txt", "serial.txt"
+    ]
+
+
+def test_parallel_failure_propagates_and_removes_parts(tmp_path):
+    input_path = tmp_path / "input.txt"
+    input_path.write_bytes(b"a\nb\nc\nd\n")
+
+    with pytest.raises(RuntimeError, match="backend failed"):
+        stream_redact_parallel(input_path, tmp_path / "out.txt", FailingRedactor, workers=2)
+    assert [p.name for p in tmp_path.iterdir()] == ["input.txt"]
+
+
+@pytest.mark.skipif(scan_lines is None, reason="numba not installed")
+@pytest.mark.parametrize("content, calls", [
+    (b"plain\nCall 555\nBob\n", [(["Call 555", "Bob"], True)]),
+    ("plain\nCall 555\n\xe9t\xe9\n".encode("utf-8"), [(["Call 555", "\xe9t\xe9"], False)]),
+])
+def test_scanned_ascii_blocks_skip_gate(tmp_path, content, calls):
+    input_path = tmp_path / "input.txt"
+    input_path.write_bytes(content)
+    redactor = GateRecorder()
+    stream_redact(input_path, tmp_path / "out.txt", redactor, progress=False)
+    assert redactor.calls == calls
+
+
+def test_prefetch_releases_producer_when_consumer_stops():
+    before = threading.active_count()
+    for _ in range(10):
+        items = prefetch(iter(range(1000)))
+        next(items)
+        items.close()
+    deadline = time.monotonic() + 2
+    while threading.active_count() > before and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert threading.active_count() == before
+
+
+def test_background_writer_keeps_original_exception():
+    class FailingFile:
+        def writelines(self, lines):
+            raise OSError("disk full")
+
+    with pytest.raises(KeyError):
+        with BackgroundWriter(FailingFile()) as writer:
+            writer.writelines(["line\n"])
+            raise KeyError("original")